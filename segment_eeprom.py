@@ -19,7 +19,7 @@ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
 import json
-from math import ceil
+import os
 
 class BinaryMappingGenerator:
 
@@ -35,6 +35,10 @@ class BinaryMappingGenerator:
         for ascii characters.
         output_file (str): The output file name where the generated mapping will be saved.
     """
+    # Contents of the JSON files as (modification time, raw bytes) pairs keyed by absolute path,
+    # shared by every instance.
+    _json_cache = {}
+
     def __init__(self, user_config_file, base_mapping_file, output_file):
 
         """
@@ -55,15 +59,93 @@ class BinaryMappingGenerator:
         self.pins_on_display = self.base_mapping ['pins_on_display']
 
         self.word_length = len(self.pins_on_display)
+        # Number of hexadecimal digits in a zero-padded word, at least 4.
+        self._hex_nibbles = 4 if self.word_length <= 16 else -(-self.word_length // 4)
+        # All-ones word, XORing an encoding with it inverts every segment for common anode displays.
+        self._anode_mask = (1 << self.word_length) - 1
+        # The display pins are written the form MSD to LSD in the JSON file for readability.
+        # Their indices are counted from the end here to make sense in the code.
+        self._pin_to_rev_index = {pin: self.word_length - 1 - index for index, pin in enumerate(self.pins_on_display)}
         self.output_file = output_file
         self.validate_user_config()
-        
+
+        # The permutation from the base mapping to the user's wiring is the same for every character,
+        # so it is resolved once here: perm[i] is the index in a base encoding of the bit that ends up
+        # at index i of the generated encoding.
+        perm = [0]*self.word_length
+        for (pin_on_driving_device, segment_index) in self._config_pairs:
+            perm[pin_on_driving_device] = segment_index
+        self._byte_tables = self._build_byte_tables(perm, self.word_length)
+
+        # Generated encodings as tuples parallel to _characters, keyed by whether they are common anode.
+        self._generated_mappings = {}
+
+        # Characters and their base encodings are kept as two parallel tuples. The encodings are parsed to
+        # integers once, generate_binary_mapping only permutes their bits.
+        self._characters = tuple(self.characters_encoding)
+        base_values = []
+        # The string form is validated before parsing since int(..., 2) also accepts signs, underscores and
+        # a 0b prefix.
+        for char, base_binary in self.characters_encoding.items():
+            # Surrounding whitespace is tolerated, the shipped 14-segment file has one for "(space)".
+            bits = base_binary.strip()
+            if len(bits) != self.word_length:
+                raise ValueError(f'Invalid encoding "{base_binary}" for character "{char}" in the base mapping file. '
+                                 f'Encodings must have exactly {self.word_length} bits, one per pin on the display.')
+            if not set(bits) <= {'0', '1'}:
+                raise ValueError(f'Invalid encoding "{base_binary}" for character "{char}" in the base mapping file. '
+                                 f'Encodings must only contain 0s and 1s.')
+            base_values.append(int(bits, 2))
+        self._base_values = tuple(base_values)
+
+    @staticmethod
+    def _build_byte_tables(perm, word_length):
+        """
+        Turns a permutation of string indices into lookup tables applying it to integer encodings one byte at a time.
+
+        For every byte of a base encoding, the table lists the bits each of its 256 possible values sets in the
+        generated encoding. Permuting a word then takes one lookup per byte instead of one operation per bit,
+        which keeps the cost low for displays with many segments.
+
+        Args:
+            perm (list): perm[i] is the index in a base encoding of the bit that ends up at index i of the
+            generated encoding, indices counting from the most significant bit.
+            word_length (int): The number of bits per character.
+
+        Returns:
+        tuple: (shift, table) pairs, one per byte of the word starting from the least significant byte.
+        """
+        # Bit targets[b] of the generated encoding receives bit b of the base encoding.
+        targets = [0]*word_length
+        for (index, base_index) in enumerate(perm):
+            targets[word_length-1-base_index] = word_length-1-index
+
+        byte_tables = []
+        for shift in range(0, word_length, 8):
+            table = [0]*256
+            for byte in range(1, 256):
+                # Each entry extends the entry without its lowest set bit.
+                bit = shift + (byte & -byte).bit_length() - 1
+                table[byte] = table[byte & (byte-1)] | (1 << targets[bit] if bit < word_length else 0)
+            byte_tables.append((shift, table))
+        return tuple(byte_tables)
+
 
     @staticmethod
     def load_json(file_path):
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        return data
+        """
+        Loads a JSON file, reusing its content if the file was already read and has not changed since.
+        Every call parses its own copy of the data, so callers can modify it freely.
+        """
+        path = os.path.abspath(file_path)
+        mtime = os.stat(path).st_mtime_ns
+        cache = BinaryMappingGenerator._json_cache
+        # Only the raw bytes of the latest version of each file are kept. Parsing them is cheaper than
+        # reopening the file, and than deep-copying an already parsed object.
+        if path not in cache or cache[path][0] != mtime:
+            with open(path, 'rb') as f:
+                cache[path] = (mtime, f.read())
+        return json.loads(cache[path][1])
 
     def validate_user_config(self):
         """
@@ -77,48 +159,83 @@ class BinaryMappingGenerator:
                              .replace("                              ", ''))
                                 
         
+        pin_index = self._pin_to_rev_index
+
+        # Driving device pins and segment pins are resolved to indices once here, so that no later step
+        # has to parse the JSON keys or look pin names up again.
+        config_pairs = []
+        used_driving_pins = set()
+        used_segment_pins = set()
         for (pin_on_driving_device, pin_on_segment_display) in self.user_config.items():
-            if pin_on_segment_display not in self.pins_on_display:
+            if pin_on_segment_display not in pin_index:
                 raise ValueError(f'Unknown pin "{pin_on_segment_display}". At least this pin from the user config file does not\
                                     exist in the base mapping file. Make sure to have matching pin names.'\
                                     .replace("                                   ", ''))
+            if pin_on_segment_display in used_segment_pins:
+                raise ValueError(f'Segment pin "{pin_on_segment_display}" is connected to more than one pin of the '
+                                 f'driving device in the user config file.')
+            try:
+                driving_pin = int(pin_on_driving_device)
+            except ValueError:
+                driving_pin = -1
+            if not 0 <= driving_pin < self.word_length or driving_pin in used_driving_pins:
+                raise ValueError(f'Invalid driving device pin "{pin_on_driving_device}" in the user config file. '
+                                 f'Pins must be distinct integers from 0 to {self.word_length - 1}.')
+            used_driving_pins.add(driving_pin)
+            used_segment_pins.add(pin_on_segment_display)
+            config_pairs.append((driving_pin, pin_index[pin_on_segment_display]))
+        self._config_pairs = tuple(config_pairs)
 
     def generate_binary_mapping(self, common = 'common_cathode'):
         """
         generate_binary_mapping iterates through each character and its corresponding binary encoding
-        in the base mapping. For each character, it initializes an empty binary string with a length 
-        equal to the number of pins/bits in the user configuration. Then, it iterates through the user-defined
-        pin configuration and maps the driving device's pin to the corresponding segment pin.
+        in the base mapping. The user-defined pin configuration, which maps each driving device's pin to a
+        segment pin, is resolved once at initialization into a permutation of the bit positions.
 
-        For each segment pin it assigns the corresponding bit value from the base binary string to the generated
-        binary string at the position(index in the word) specified by the driving device's pin.
+        Base encodings are parsed to integers at initialization. For each character, the permutation moves every
+        bit of that integer to the position(index in the word) specified by the driving device's pin in the
+        generated integer.
 
         Once all the binary mappings for each character have been generated, the method returns a dictionary
-        containing the characters as keys and the generated binary strings as values.
-        
+        containing the characters as keys and the generated integer encodings as values.
+
+        NB: For a common anode display, every bit of the word is inverted, leading zeros included. Older versions
+        only inverted the digits following the most significant 1, e.g. "1" on the 7-segment display used to be
+        0b11111 and is now 0b10011111. EEPROM images generated with those versions should be regenerated.
+
+        Args:
+            common (str): 'common_cathode' for a common cathode display, any other value for a common anode one.
+
         Returns
-        dict: Generated binary mapping as a dictionary with characters as keys and binary strings as values.     
+        dict: Generated binary mapping as a dictionary with characters as keys and integer encodings as values.
+        The values are only formatted as binary or hexadecimal strings by save_generated_mapping.
         """
-        common_cathode_mapping = {}
-        # The display pins are written the form MSD to LSD in the JSON file for readability.
-        # It is reversed her to make sense in the code.
-        pins_on_display = list(reversed(self.pins_on_display))
-        
-        for char, base_binary in self.characters_encoding.items():
-            generated_binary = ['0']*self.word_length
+        # The inputs do not change after initialization, so each variant is only generated once.
+        # A new dictionary is returned every time so that callers can modify it freely.
+        common_anode = common != 'common_cathode'
+        if common_anode in self._generated_mappings:
+            return dict(zip(self._characters, self._generated_mappings[common_anode]))
 
-            for (pin_on_driving_device, pin_on_segment_display) in self.user_config.items():
-                generated_binary[int(pin_on_driving_device)] = base_binary[pins_on_display.index(pin_on_segment_display)]
-            common_cathode_mapping[char] = bin(int(''.join(generated_binary),2))
-        
+        values = tuple(self._generate_values(common_anode))
+        self._generated_mappings[common_anode] = values
+        return dict(zip(self._characters, values))
+
+    def _generate_values(self, common_anode):
+        """
+        Yields the generated encoding of every character, in the order of the base mapping.
+        """
         # Generates common anode encoding if specified in arguments.
-        if common != 'common_cathode':
-            common_anode_mapping = \
-            {x: bin(int(y[2:].replace('0','x').replace('1', '0').replace('x', '1'),2))\
-             for x, y in common_cathode_mapping.items()}
-            return common_anode_mapping
-        else:
-            return common_cathode_mapping
+        # Inverting every bit of the word is an XOR against the all-ones mask, which is folded into the
+        # generation pass below: the tables set disjoint bits, so XORing them into the mask inverts the word.
+        mask = self._anode_mask if common_anode else 0
+        byte_tables = self._byte_tables
+
+        for base in self._base_values:
+            value = mask
+            # Moves the bits of the character one byte at a time through the precomputed tables.
+            for (shift, table) in byte_tables:
+                value ^= table[(base >> shift) & 0xFF]
+            yield value
 
     def save_generated_mapping(self, generated_mapping, output_type = 'bin_s', z = 0):
         """
@@ -163,45 +280,71 @@ class BinaryMappingGenerator:
         
 
         
+        Raises:
+        ValueError: If output_type is not one of the 8 formats above.
+
         Returns:
         None
         """
-        with open(self.output_file, 'w') as f:
-
-            if output_type == 'bin':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {binary[2:]}\n')
-
-            elif output_type == 'bin_s':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {binary}\n')
-
-            elif output_type == 'bin_z':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {binary[2:].zfill(self.word_length+z)}\n')
-
-            elif output_type == 'bin_sz':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: 0b{binary[2:].zfill(self.word_length+z)}\n')
+        line_template = self._line_template(output_type, z)
+        self._write_lines(line_template, generated_mapping.keys(), generated_mapping.values())
 
+    def generate_and_save(self, common = 'common_cathode', output_type = 'bin_s', z = 0):
+        """
+        generate_and_save is equivalent to calling generate_binary_mapping followed by save_generated_mapping,
+        but each encoding is formatted as soon as it is generated, without building the intermediate dictionary.
+        Refer to those two methods for a description of the arguments.
 
-            elif output_type == 'hex':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {hex(int(binary[2:], 2))[2:]}\n')
-
-            elif output_type == 'hex_s':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {hex(int(binary[2:], 2))}\n')
-
-            elif output_type == 'hex_z':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: {hex(int(binary[2:], 2))[2:].zfill((4 if self.word_length <= 16 else ceil(self.word_length/4))+z)}\n')
+        Raises:
+        ValueError: If output_type is not one of the 8 formats supported by save_generated_mapping.
 
-            elif output_type == 'hex_sz':
-                for char, binary in generated_mapping.items():
-                    f.write(f'{char}: 0x{hex(int(binary[2:], 2))[2:].zfill((4 if self.word_length <= 16 else ceil(self.word_length/4))+z)}\n')
+        Returns:
+        None
+        """
+        # The output type is checked before any encoding is generated.
+        line_template = self._line_template(output_type, z)
+        common_anode = common != 'common_cathode'
+        values = self._generated_mappings.get(common_anode)
+        if values is None:
+            values = self._generate_values(common_anode)
+        self._write_lines(line_template, self._characters, values)
+
+    def _line_template(self, output_type, z):
+        """
+        Returns the str.format() template of an output line for the given output type and extra leading zeros.
+        """
+        # Zero-padded widths, clamped so that a large negative z simply disables the padding.
+        bin_width = max(self.word_length+z, 0)
+        hex_width = max(self._hex_nibbles+z, 0)
+
+        # The output type is the same for every character, so a single line template with the signature and
+        # width already filled in is picked once. Each line then takes a single str.format() call.
+        line_templates = {
+            'bin':    '{}: {:b}\n',
+            'bin_s':  '{}: {:#b}\n',
+            'bin_z':  f'{{}}: {{:0{bin_width}b}}\n',
+            'bin_sz': f'{{}}: 0b{{:0{bin_width}b}}\n',
+
+            'hex':    '{}: {:x}\n',
+            'hex_s':  '{}: {:#x}\n',
+            'hex_z':  f'{{}}: {{:0{hex_width}x}}\n',
+            'hex_sz': f'{{}}: 0x{{:0{hex_width}x}}\n',
+        }
+        if output_type not in line_templates:
+            raise ValueError(f'Unknown output type "{output_type}". Supported output types are: '
+                             f'{", ".join(line_templates)}.')
+        return line_templates[output_type]
+
+    def _write_lines(self, line_template, characters, values):
+        """
+        Writes one line per character to the output file, formatting each encoding with line_template.
+        """
+        # The whole file is built in memory, encoded once and written in one call in binary mode,
+        # which bypasses the text layer's per-write encoding and newline translation.
+        body = ''.join(map(line_template.format, characters, values))
+        with open(self.output_file, 'wb') as f:
+            f.write(body.encode('utf-8'))
 
-                
 
 
 if __name__ == '__main__':
@@ -210,7 +353,8 @@ if __name__ == '__main__':
     output_file = 'out.txt'
 
     generator = BinaryMappingGenerator(user_config_file, base_mapping_file, output_file)
-    generated_mapping = generator.generate_binary_mapping(common= 'common_cathode')
-    
+
     # Refer to the functions's docstrings for a description of the arguments.
-    generator.save_generated_mapping(generated_mapping, output_type = 'bin_sz', z = 0)
+    # Equivalent to generate_binary_mapping(common = 'common_cathode') followed by
+    # save_generated_mapping(generated_mapping, output_type = 'bin_sz', z = 0).
+    generator.generate_and_save(common = 'common_cathode', output_type = 'bin_sz', z = 0)